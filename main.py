@@ -1,80 +1,119 @@
+import hashlib
 import logging.config
+import os
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import Annotated
 
 import uvicorn
+from cachetools import TTLCache
 from fastapi import FastAPI, status, Header, Path, Depends, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from sqlalchemy import select
-from starlette.responses import JSONResponse, Response
+from sqlalchemy import bindparam, delete, select
+from sqlalchemy.orm import selectinload
+from starlette.responses import Response
 
-from src import Banner, User, base_init, create_session, Tag
+from src import Banner, BannerTag, User, base_init_async, create_session, dispose_engine, Tag
 from src.config import DB_PATH, LOGGER_CONFIG
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    await base_init_async(DB_PATH)
+    yield
+    await dispose_engine()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 logging.config.dictConfig(LOGGER_CONFIG)
 logger = logging.getLogger("app")
 
 
-async def user_token_verification(token: Annotated[str | None, Header()] = None):
-    if token is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+_token_cache: TTLCache = TTLCache(maxsize=10000, ttl=60)
+_banner_cache: TTLCache = TTLCache(maxsize=10000, ttl=300)
 
-    async with create_session() as session:
-        query = select(User).where(User.token == token)
-        result = (await session.scalars(query)).all()
-        if len(result) < 1:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+_USER_BY_TOKEN_STMT = select(User).where(User.token == bindparam("token")).limit(1)
+_BANNER_CONTENT_STMT = select(Banner.content).join(Banner.tags).where(
+    (Banner.feature_id == bindparam("feature_id")) &
+    (Tag.tag_id == bindparam("tag_id")) &
+    Banner.is_active).limit(1)
 
 
-async def admin_token_verification(token: Annotated[str | None, Header()] = None):
-    if token is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+def _token_cache_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()[:16]
 
+
+async def _resolve_token(token: str) -> tuple[int, bool] | None:
+    key = _token_cache_key(token)
+    cached = _token_cache.get(key)
+    if cached is not None:
+        return cached
     async with create_session() as session:
-        query = select(User).where(User.token == token)
-        result = (await session.scalars(query)).all()
-        if len(result) < 1:
+        user = (await session.scalars(_USER_BY_TOKEN_STMT, {"token": token})).first()
+        if user is None:
+            return None
+    _token_cache[key] = (user.user_id, user.admin)
+    return user.user_id, user.admin
+
+
+def require_user(admin: bool = False):
+    async def token_verification(token: Annotated[str | None, Header()] = None):
+        if token is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+        resolved = await _resolve_token(token)
+        if resolved is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
-        if not result[0].admin:
+        if admin and not resolved[1]:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    return token_verification
 
 
-@app.get("/user_banner", dependencies=[Depends(user_token_verification)])
+@app.get("/user_banner", dependencies=[Depends(require_user())])
 async def user_banner(tag_id: int, feature_id: int, use_last_revision: bool = True):
+    cache_key = (feature_id, tag_id)
+    if not use_last_revision:
+        cached = _banner_cache.get(cache_key)
+        if cached is not None:
+            return Response(content=cached, media_type="application/json",
+                            status_code=status.HTTP_200_OK)
+
     async with create_session() as session:
-        tag = await session.get(Tag, tag_id)
-        if tag is None:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-        query = select(Banner).join(Banner.tags).where((Banner.feature_id == feature_id) &
-                                                       (Tag.tag_id == tag_id) &
-                                                       Banner.is_active)
-        results = (await session.scalars(query)).all()
-        if len(results) < 1:
+        content = (await session.scalars(_BANNER_CONTENT_STMT,
+                                         {"feature_id": feature_id, "tag_id": tag_id})).first()
+        if content is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-        content = results[0].content
-        return JSONResponse(content=content, status_code=status.HTTP_200_OK)
+        _banner_cache[cache_key] = content
+        return Response(content=content, media_type="application/json",
+                        status_code=status.HTTP_200_OK)
 
 
-@app.get("/banner", dependencies=[Depends(admin_token_verification)])
+@app.get("/banner", dependencies=[Depends(require_user(admin=True))])
 async def get_banners(feature_id: int | None = None, tag_id: int | None = None,
                       limit: int | None = None, offset: int | None = 0):
     async with create_session() as session:
+        conditions = []
+        if feature_id is not None:
+            conditions.append(Banner.feature_id == feature_id)
         if tag_id is not None:
-            tag = await session.get(Tag, tag_id)
-            if tag is None:
-                return JSONResponse(content=[], status_code=status.HTTP_200_OK)
-        query = select(Banner).join(Banner.tags).where(
-            ((Banner.feature_id == feature_id) if feature_id is not None else True) &
-            ((Tag.tag_id == tag_id) if tag_id is not None else True))
-        results = (await session.scalars(query)).all()
+            conditions.append(Tag.tag_id == tag_id)
+        query = select(Banner).options(selectinload(Banner.tags)).join(Banner.tags).where(
+            *conditions).order_by(Banner.banner_id)
         if limit is not None:
-            results = results[offset:offset + limit]
+            query = query.limit(limit).offset(offset or 0)
+        results = (await session.scalars(query)).all()
 
-        for i in range(len(results)):
-            results[i] = results[i].get_as_dict()
-        return JSONResponse(content=results, status_code=status.HTTP_200_OK)
+        content = [banner.get_as_dict() for banner in results]
+        return ORJSONResponse(content=content, status_code=status.HTTP_200_OK)
+
+
+async def _get_or_create_tags(session, tag_ids: list[int]) -> list[Tag]:
+    existing = (await session.scalars(select(Tag).where(Tag.tag_id.in_(tag_ids)))).all()
+    missing = [Tag(tag_id=tag_id) for tag_id in set(tag_ids) - {tag.tag_id for tag in existing}]
+    session.add_all(missing)
+    return list(existing) + missing
 
 
 class PostBanner(BaseModel):
@@ -84,22 +123,18 @@ class PostBanner(BaseModel):
     is_active: bool = True
 
 
-@app.post("/banner", dependencies=[Depends(admin_token_verification)])
+@app.post("/banner", dependencies=[Depends(require_user(admin=True))])
 async def post_banner(args: PostBanner):
     async with create_session() as session:
+        now = datetime.now().isoformat()
         banner = Banner(feature_id=args.feature_id, content=args.content,
-                        is_active=args.is_active, created_at=datetime.now().isoformat(),
-                        updated_at=datetime.now().isoformat())
-        for tag_id in args.tag_ids:
-            tag = await session.get(Tag, tag_id)
-            if tag is None:
-                tag = Tag(tag_id=tag_id)
-                session.add(tag)
-            banner.tags.append(tag)
+                        is_active=args.is_active, created_at=now, updated_at=now)
+        banner.tags = await _get_or_create_tags(session, args.tag_ids)
         session.add(banner)
-        await session.flush()
         await session.commit()
-        return JSONResponse(content={"banner_id": banner.banner_id}, status_code=status.HTTP_201_CREATED)
+        for tag_id in args.tag_ids:
+            _banner_cache.pop((args.feature_id, tag_id), None)
+        return ORJSONResponse(content={"banner_id": banner.banner_id}, status_code=status.HTTP_201_CREATED)
 
 
 class PatchBanner(BaseModel):
@@ -109,21 +144,20 @@ class PatchBanner(BaseModel):
     is_active: bool | None = None
 
 
-@app.patch("/banner/{banner_id}", dependencies=[Depends(admin_token_verification)])
+@app.patch("/banner/{banner_id}", dependencies=[Depends(require_user(admin=True))])
 async def patch_banner(args: PatchBanner, banner_id: Annotated[int, Path()]):
     async with create_session() as session:
-        banner = await session.get(Banner, banner_id)
+        banner = await session.get(Banner, banner_id, options=[selectinload(Banner.tags)])
         if banner is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
         if args.tag_ids is not None:
-            banner.tags = []
-            for tag_id in args.tag_ids:
-                tag = await session.get(Tag, tag_id)
-                if tag is None:
-                    tag = Tag(tag_id=tag_id)
-                    session.add(tag)
-                banner.tags.append(tag)
+            current = {tag.tag_id for tag in banner.tags}
+            desired = set(args.tag_ids)
+            if current != desired:
+                to_add = [tag_id for tag_id in args.tag_ids if tag_id not in current]
+                new_tags = await _get_or_create_tags(session, to_add) if to_add else []
+                banner.tags = [tag for tag in banner.tags if tag.tag_id in desired] + new_tags
         if args.feature_id is not None:
             banner.feature_id = args.feature_id
         if args.content is not None:
@@ -133,21 +167,22 @@ async def patch_banner(args: PatchBanner, banner_id: Annotated[int, Path()]):
         banner.updated_at = datetime.now().isoformat()
 
         await session.commit()
+        _banner_cache.clear()
         return Response(status_code=status.HTTP_200_OK)
 
 
-@app.delete("/banner/{banner_id}", dependencies=[Depends(admin_token_verification)])
+@app.delete("/banner/{banner_id}", dependencies=[Depends(require_user(admin=True))])
 async def delete_banner(banner_id: Annotated[int, Path()]):
     async with create_session() as session:
-        banner = await session.get(Banner, banner_id)
-        if banner:
-            await session.delete(banner)
-            await session.commit()
-        else:
-            return status.HTTP_404_NOT_FOUND
+        await session.execute(delete(BannerTag).where(BannerTag.banner_id == banner_id))
+        result = await session.execute(delete(Banner).where(Banner.banner_id == banner_id))
+        await session.commit()
+        if result.rowcount == 0:
+            return Response(status_code=status.HTTP_404_NOT_FOUND)
+        _banner_cache.clear()
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 if __name__ == '__main__':
-    base_init(DB_PATH)
-    uvicorn.run("main:app", port=8000, reload=False, log_level="info")
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False, log_level="info",
+                workers=os.cpu_count(), loop="uvloop", http="httptools", access_log=False)
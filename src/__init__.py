@@ -1,3 +1,3 @@
 from .users import User
-from .banners import Banner, Tag
-from .db_session import base_init, create_session
+from .banners import Banner, BannerTag, Tag
+from .db_session import base_init, base_init_async, create_session, dispose_engine
@@ -1,4 +1,4 @@
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from src.db_session import SqlAlchemyBase
@@ -12,10 +12,11 @@ class Tag(SqlAlchemyBase):
 
 class Banner(SqlAlchemyBase):
     __tablename__ = 'banners'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (Index("ix_banners_feature_id_is_active", "feature_id", "is_active"),
+                      {'extend_existing': True})
     banner_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     feature_id: Mapped[int] = mapped_column(nullable=False)
-    tags: Mapped[list[Tag]] = relationship(secondary='banner_tags', lazy="selectin")
+    tags: Mapped[list[Tag]] = relationship(secondary='banner_tags', lazy="raise")
     content:  Mapped[str] = mapped_column(nullable=False)
     is_active: Mapped[bool] = mapped_column(nullable=False, default=True)
     created_at: Mapped[str] = mapped_column(nullable=False)
@@ -35,7 +36,8 @@ class Banner(SqlAlchemyBase):
 
 class BannerTag(SqlAlchemyBase):
     __tablename__ = 'banner_tags'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (Index("ix_banner_tags_tag_id_banner_id", "tag_id", "banner_id"),
+                      {'extend_existing': True})
     banner_tag_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     banner_id: Mapped[int] = mapped_column(ForeignKey("banners.banner_id"), nullable=False)
     tag_id: Mapped[int] = mapped_column(ForeignKey("tags.tag_id"), nullable=False)
@@ -1,5 +1,6 @@
 import asyncio
 from pathlib import Path
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import Session
 import sqlalchemy.ext.declarative as dec
@@ -7,27 +8,57 @@ import sqlalchemy.ext.declarative as dec
 
 SqlAlchemyBase = dec.declarative_base()
 __factory = None
+__engine = None
 
 
-def base_init(db_file: Path):
-    global __factory
-    if __factory:
-        return
+def _configure(db_file: Path):
+    global __factory, __engine
     if not db_file.parent.exists():
         raise Exception("Parent folder doesn't exist")
     conn_str = f'sqlite+aiosqlite:///{db_file}?check_same_thread=False'
     print(f"Connection to base {db_file}\n")
-    engine = create_async_engine(conn_str, echo=False)
-    __factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+    __engine = create_async_engine(conn_str, echo=False, pool_size=20, max_overflow=10,
+                                   pool_pre_ping=True, pool_recycle=1800, pool_timeout=30,
+                                   query_cache_size=1200)
+    __factory = async_sessionmaker(bind=__engine, expire_on_commit=False)
     import src.__all_models__
 
+
+def base_init(db_file: Path):
+    global __factory
+    if __factory:
+        return
+    _configure(db_file)
+
     async def init_models():
-        async with engine.begin() as conn:
+        async with __engine.begin() as conn:
             await conn.run_sync(SqlAlchemyBase.metadata.create_all)
 
     asyncio.run(init_models())
 
 
+async def base_init_async(db_file: Path):
+    global __factory
+    if __factory:
+        return
+    _configure(db_file)
+    try:
+        async with __engine.begin() as conn:
+            await conn.run_sync(SqlAlchemyBase.metadata.create_all)
+    except OperationalError as e:
+        # Several uvicorn workers run this concurrently on startup and
+        # create_all's existence check is not atomic across processes;
+        # losing the race means another worker created the schema first.
+        if "already exists" not in str(e):
+            raise
+
+
 def create_session() -> Session:
     global __factory
     return __factory()
+
+
+async def dispose_engine():
+    global __engine
+    if __engine is not None:
+        await __engine.dispose()
@@ -8,5 +8,5 @@ class User(SqlAlchemyBase):
     __table_args__ = {'extend_existing': True}
     user_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     username: Mapped[str] = mapped_column(nullable=False)
-    token: Mapped[str] = mapped_column(nullable=False)
+    token: Mapped[str] = mapped_column(nullable=False, unique=True, index=True)
     admin: Mapped[bool] = mapped_column(nullable=False, default=False)
@@ -1,10 +1,12 @@
+import asyncio
+import json
 import logging
 from contextlib import asynccontextmanager
 
 import pytest
 from httpx import AsyncClient
 
-from main import app, PostBanner
+from main import app, PostBanner, _banner_cache, _token_cache
 from src import base_init, create_session, User
 from tests.config import DB_PATH
 
@@ -17,6 +19,21 @@ DEFAULT_USERNAME = "test_user"
 DEFAULT_TOKEN = "test_token"
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # Tests create and delete users with the same token (and different
+    # admin flags) straight through the session, so cached auth state
+    # must not leak from one test into the next.
+    _token_cache.clear()
+    _banner_cache.clear()
+
+
+@pytest.fixture(scope="session")
+async def client():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        yield ac
+
+
 async def _create_test_user(username: str = DEFAULT_USERNAME, token: str = DEFAULT_TOKEN,
                             admin: bool = False) -> tuple[int, str]:
     async with create_session() as session:
@@ -42,41 +59,44 @@ async def context_user(*args, **kwargs):
     await _delete_test_user(user_id)
 
 
-async def _create_banners(post_banners: list[PostBanner], admin_token: str) -> list[int]:
+async def _create_banners(client: AsyncClient, post_banners: list[PostBanner], admin_token: str) -> list[int]:
+    responses = await asyncio.gather(*(
+        client.post(
+            "/banner",
+            json={
+                "feature_id": post_banner.feature_id,
+                "tag_ids": post_banner.tag_ids,
+                "content": post_banner.content,
+                "is_active": post_banner.is_active,
+            },
+            headers={"token": admin_token},
+        )
+        for post_banner in post_banners
+    ))
     banner_ids = []
-    async with AsyncClient(app=app, base_url="http://test") as ac:
-        for post_banner in post_banners:
-            response = await ac.post(
-                "/banner",
-                json={
-                    "feature_id": post_banner.feature_id,
-                    "tag_ids": post_banner.tag_ids,
-                    "content": post_banner.content,
-                    "is_active": post_banner.is_active,
-                },
-                headers={"token": admin_token},
-            )
-            assert response.status_code == 201
-            banner_id = response.json()["banner_id"]
-            banner_ids.append(banner_id)
+    for response in responses:
+        assert response.status_code == 201
+        banner_ids.append(response.json()["banner_id"])
     return banner_ids
 
 
-async def _delete_banners(banner_ids: list[int], admin_token: str) -> None:
-    async with AsyncClient(app=app, base_url="http://test") as ac:
-        for banner_id in banner_ids:
-            response = await ac.delete(
-                f"/banner/{banner_id}",
-                headers={"token": admin_token},
-            )
-            assert response.status_code == 204
+async def _delete_banners(client: AsyncClient, banner_ids: list[int], admin_token: str) -> None:
+    responses = await asyncio.gather(*(
+        client.delete(
+            f"/banner/{banner_id}",
+            headers={"token": admin_token},
+        )
+        for banner_id in banner_ids
+    ))
+    for response in responses:
+        assert response.status_code == 204
 
 
 @asynccontextmanager
-async def context_banners(post_banners: list[PostBanner], admin_token: str):
-    banner_ids = await _create_banners(post_banners, admin_token)
+async def context_banners(client: AsyncClient, post_banners: list[PostBanner], admin_token: str):
+    banner_ids = await _create_banners(client, post_banners, admin_token)
     yield banner_ids
-    await _delete_banners(banner_ids, admin_token)
+    await _delete_banners(client, banner_ids, admin_token)
 
 
 @pytest.mark.parametrize(
@@ -87,31 +107,30 @@ async def context_banners(post_banners: list[PostBanner], admin_token: str):
         (DEFAULT_BANNER, "wrong_token", 401),
     ]
 )
-async def test_banner_creation(post_banner: PostBanner, token: str | None, status_code: int) -> None:
+async def test_banner_creation(client: AsyncClient, post_banner: PostBanner, token: str | None,
+                               status_code: int) -> None:
     async with context_user(admin=True) as admin_token:
         # Create new banner
         headers = {"token": token} if token else {}
-        async with AsyncClient(app=app, base_url="http://test") as ac:
-            response = await ac.post(
-                "/banner",
-                json={
-                    "feature_id": post_banner.feature_id,
-                    "tag_ids": post_banner.tag_ids,
-                    "content": post_banner.content,
-                    "is_active": post_banner.is_active,
-                },
-                headers=headers,
-            )
+        response = await client.post(
+            "/banner",
+            json={
+                "feature_id": post_banner.feature_id,
+                "tag_ids": post_banner.tag_ids,
+                "content": post_banner.content,
+                "is_active": post_banner.is_active,
+            },
+            headers=headers,
+        )
         assert response.status_code == status_code
         if status_code == 201:
             banner_id = response.json()["banner_id"]
 
             # Delete banner
-            async with AsyncClient(app=app, base_url="http://test") as ac:
-                response = await ac.delete(
-                    f"/banner/{banner_id}",
-                    headers={"token": admin_token},
-                )
+            response = await client.delete(
+                f"/banner/{banner_id}",
+                headers={"token": admin_token},
+            )
             assert response.status_code == 204
 
 
@@ -123,59 +142,65 @@ async def test_banner_creation(post_banner: PostBanner, token: str | None, statu
         (DEFAULT_BANNER, "wrong_token", 401),
     ]
 )
-async def test_banner_deletion(post_banner: PostBanner, token: str | None, status_code: int) -> None:
+async def test_banner_deletion(client: AsyncClient, post_banner: PostBanner, token: str | None,
+                               status_code: int) -> None:
     async with context_user(admin=True) as admin_token:
         # Create new banner
-        async with AsyncClient(app=app, base_url="http://test") as ac:
-            response = await ac.post(
-                "/banner",
-                json={
-                    "feature_id": post_banner.feature_id,
-                    "tag_ids": post_banner.tag_ids,
-                    "content": post_banner.content,
-                    "is_active": post_banner.is_active,
-                },
-                headers={"token": admin_token},
-            )
+        response = await client.post(
+            "/banner",
+            json={
+                "feature_id": post_banner.feature_id,
+                "tag_ids": post_banner.tag_ids,
+                "content": post_banner.content,
+                "is_active": post_banner.is_active,
+            },
+            headers={"token": admin_token},
+        )
         assert response.status_code == 201
         banner_id = response.json()["banner_id"]
 
         # Delete banner
         headers = {"token": token} if token else {}
-        async with AsyncClient(app=app, base_url="http://test") as ac:
-            response = await ac.delete(
-                f"/banner/{banner_id}",
-                headers=headers,
-            )
+        response = await client.delete(
+            f"/banner/{banner_id}",
+            headers=headers,
+        )
         assert response.status_code == status_code
 
-        if status_code != 204:
-            async with AsyncClient(app=app, base_url="http://test") as ac:
-                response = await ac.delete(
-                    f"/banner/{banner_id}",
-                    headers={"token": admin_token},
-                )
+        if status_code == 204:
+            # Deleting the same banner again should report it as missing
+            response = await client.delete(
+                f"/banner/{banner_id}",
+                headers={"token": admin_token},
+            )
+            assert response.status_code == 404
+        else:
+            response = await client.delete(
+                f"/banner/{banner_id}",
+                headers={"token": admin_token},
+            )
 
 
 @pytest.mark.parametrize(
     "post_banners, token, params, status_code, result_banners",
     [
         ([DEFAULT_BANNER], DEFAULT_TOKEN, {"feature_id": 1, "tag_id": 1}, 200, [DEFAULT_BANNER]),
+        ([DEFAULT_BANNER], DEFAULT_TOKEN, {"tag_id": 1}, 200, [DEFAULT_BANNER]),
+        ([DEFAULT_BANNER], DEFAULT_TOKEN, {"tag_id": 99}, 200, []),
         ([DEFAULT_BANNER], None, {"feature_id": 1, "tag_id": 1}, 401, None),
         ([DEFAULT_BANNER], "wrong_token", {"feature_id": 1, "tag_id": 1}, 401, None),
     ]
 )
-async def test_get_banners(post_banners: list[PostBanner], token: str | None, params: dict[str, int],
-                           status_code: int, result_banners: list[PostBanner]) -> None:
+async def test_get_banners(client: AsyncClient, post_banners: list[PostBanner], token: str | None,
+                           params: dict[str, int], status_code: int, result_banners: list[PostBanner]) -> None:
     async with (context_user(admin=True) as admin_token,
-                context_banners(post_banners, admin_token)):
+                context_banners(client, post_banners, admin_token)):
         headers = {"token": token} if token else {}
-        async with AsyncClient(app=app, base_url="http://test") as ac:
-            response = await ac.get(
-                "/banner",
-                params=params,
-                headers=headers,
-            )
+        response = await client.get(
+            "/banner",
+            params=params,
+            headers=headers,
+        )
         assert response.status_code == status_code
         if status_code == 200:
             result_banners = set(map(lambda x: (x.feature_id, tuple(x.tag_ids), x.content, x.is_active), result_banners))
@@ -193,20 +218,20 @@ async def test_get_banners(post_banners: list[PostBanner], token: str | None, pa
         (DEFAULT_BANNER, 2, 1, 404),
     ]
 )
-async def test_user_banner(post_banner: PostBanner, feature_id: int, tag_id: int, status_code: int) -> None:
+async def test_user_banner(client: AsyncClient, post_banner: PostBanner, feature_id: int, tag_id: int,
+                           status_code: int) -> None:
     async with (context_user() as user_token,
                 context_user(token="admin_token", admin=True) as admin_token,
-                context_banners([post_banner], admin_token)):
+                context_banners(client, [post_banner], admin_token)):
         # Get banner
-        async with AsyncClient(app=app, base_url="http://test") as ac:
-            response = await ac.get(
-                "/user_banner",
-                params={"feature_id": feature_id, "tag_id": tag_id},
-                headers={"token": user_token},
-            )
+        response = await client.get(
+            "/user_banner",
+            params={"feature_id": feature_id, "tag_id": tag_id},
+            headers={"token": user_token},
+        )
         assert response.status_code == status_code
         if status_code == 200:
-            assert str(response.json()) == post_banner.content
+            assert response.json() == json.loads(post_banner.content)
 
 
 @pytest.mark.parametrize(
@@ -218,17 +243,16 @@ async def test_user_banner(post_banner: PostBanner, feature_id: int, tag_id: int
         (DEFAULT_BANNER, {"is_active": False}, 200),
     ]
 )
-async def test_patch_banner(post_banner: PostBanner, params: dict[str, int | str | bool | list[int]],
-                            status_code: int):
+async def test_patch_banner(client: AsyncClient, post_banner: PostBanner,
+                            params: dict[str, int | str | bool | list[int]], status_code: int):
     async with (context_user(admin=True) as admin_token,
-                context_banners([post_banner], admin_token) as banner_ids):
+                context_banners(client, [post_banner], admin_token) as banner_ids):
         banner_id = banner_ids[0]
-        async with AsyncClient(app=app, base_url="http://test") as ac:
-            response = await ac.patch(
-                f"/banner/{banner_id}",
-                json=params,
-                headers={"token": admin_token},
-            )
+        response = await client.patch(
+            f"/banner/{banner_id}",
+            json=params,
+            headers={"token": admin_token},
+        )
         assert response.status_code == status_code
         if status_code != 200:
             return
@@ -237,12 +261,11 @@ async def test_patch_banner(post_banner: PostBanner, params: dict[str, int | str
             "tag_ids": params["tag_ids"] if "tag_ids" in params else post_banner.tag_ids[0],
             "limit": 1,
         }
-        async with AsyncClient(app=app, base_url="http://test") as ac:
-            response = await ac.get(
-                "/banner",
-                params=get_params,
-                headers={"token": admin_token},
-            )
+        response = await client.get(
+            "/banner",
+            params=get_params,
+            headers={"token": admin_token},
+        )
         assert response.status_code == 200
         assert len(response.json()) == 1
         banner = response.json()[0]